@@ -1,32 +1,59 @@
-import re
-from dataclasses import dataclass
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
 from datetime import datetime
 from pathlib import Path
+from typing import Optional
 
 from frontmatter import Frontmatter
 
-TITLE_PREFIX_RE = re.compile(r"^\d+_")
+def strip_title_prefix(name: str) -> str:
+    # Equivalent to re.sub(r"^\d+_", "", name)
+    i = 0
+    while i < len(name) and name[i].isdecimal():
+        i += 1
+    if 0 < i < len(name) and name[i] == "_":
+        return name[i + 1:]
+    return name
+
+def _strip_frontmatter(text: str) -> str:
+    match = Frontmatter._regex.search(text)
+    if match is None or match.group(1) == '':
+        return text
+    return match.group(2)
+
+def _read_frontmatter(path: str) -> tuple[dict, str]:
+    text = Path(path).read_text(encoding="utf-8")
+    return Frontmatter.read(text)['attributes'] or {}, _strip_frontmatter(text)
+
+def _read_body(path: str) -> str:
+    return _strip_frontmatter(Path(path).read_text(encoding="utf-8"))
 
 @dataclass
 class FileEntry:
     path: Path
     attrs: dict
+    _body: Optional[str] = field(default=None, repr=False, compare=False)
+    route: str = field(init=False, repr=False)
+    title: str = field(init=False, repr=False)
+
+    def __post_init__(self):
+        name = strip_title_prefix(self.path.stem)
+        self.route = name + ".html"
+        self.title = self.attrs.get("title") or name.replace("_", " ")
 
     @classmethod
     def parse(cls, path: Path) -> 'FileEntry':
-        conf = Frontmatter.read_file(path)
-        return cls(path, conf['attributes'] or {})
+        attrs, body = _read_frontmatter(str(path))
+        return cls(path, attrs, body)
 
     @property
-    def route(self) -> str:
-        return TITLE_PREFIX_RE.sub("", self.path.stem) + ".html"
-
-    @property
-    def title(self) -> str:
-        if title := self.attrs.get("title"):
-            return title
-        name = TITLE_PREFIX_RE.sub("", self.path.stem)
-        return name.replace("_", " ")
+    def body(self) -> str:
+        if self._body is None:
+            self._body = _read_body(str(self.path))
+        return self._body
 
     @property
     def draft(self) -> bool:
@@ -43,51 +70,80 @@ class FolderEntry:
     folders: list['FolderEntry']
     files: list[FileEntry]
     assets: list[Path]
+    route: str = field(init=False, repr=False)
+    title: str = field(init=False, repr=False)
+    no_content: bool = field(init=False, repr=False)
+    empty: bool = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.route = strip_title_prefix(self.path.name)
+        self.title = strip_title_prefix(self.path.stem).replace("_", " ")
 
     @classmethod
-    def parse(cls, path: Path) -> 'FolderEntry':
+    def parse(cls, path: Path, cache: Optional[dict] = None) -> 'FolderEntry':
+        if cache is None:
+            cache = {}
+        visited: dict[str, dict] = {}
+        root = cls(path, [], [], [])
         folders: list[FolderEntry] = []
-        files: list[FileEntry] = []
-        assets: list[Path] = []
-        for e in path.iterdir():
-            if e.name.startswith("."):
-                continue
-            if e.is_dir():
-                folders.append(FolderEntry.parse(e))
-            elif e.suffix == ".md":
-                files.append(FileEntry.parse(e))
-            else:
-                assets.append(e)
-
-        folders.sort(key=lambda f: f.path.stem)
-        files.sort(key=lambda f: f.path.stem)
-
+        pages: list[tuple[FolderEntry, str]] = []
+        stack = [root]
+        while stack:
+            folder = stack.pop()
+            with os.scandir(folder.path) as it:
+                for e in it:
+                    if e.name.startswith("."):
+                        continue
+                    if e.is_dir():
+                        child = cls(Path(e.path), [], [], [])
+                        folder.folders.append(child)
+                        stack.append(child)
+                    elif e.name.endswith(".md"):
+                        st = e.stat()
+                        cached = cache.get(e.path)
+                        if cached and cached['mtime'] == st.st_mtime_ns and cached['size'] == st.st_size:
+                            folder.files.append(FileEntry(Path(e.path), cached['attrs']))
+                            visited[e.path] = cached
+                        else:
+                            pages.append((folder, e.path))
+                            visited[e.path] = {'mtime': st.st_mtime_ns, 'size': st.st_size, 'attrs': None}
+                    else:
+                        folder.assets.append(Path(e.path))
+            folders.append(folder)
+
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            mp_context = multiprocessing.get_context("forkserver")
+        else:
+            mp_context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(mp_context=mp_context) as executor:
+            parsed = executor.map(_read_frontmatter, [p for (_, p) in pages], chunksize=16)
+            for (folder, p), (attrs, body) in zip(pages, parsed):
+                folder.files.append(FileEntry(Path(p), attrs, body))
+                try:
+                    json.dumps(attrs)
+                    visited[p]['attrs'] = attrs
+                except TypeError:
+                    del visited[p]
+
+        cache.clear()
+        cache.update(visited)
+
+        for folder in reversed(folders):
+            folder.folders.sort(key=lambda f: f.path.stem)
+            folder.files.sort(key=lambda f: f.path.stem)
+            folder._check_routes()
+            folder.no_content = all(f.empty for f in folder.folders) and all(f.draft for f in folder.files)
+            folder.empty = folder.no_content and len(folder.assets) == 0
+
+        return root
+
+    def _check_routes(self):
         routes = set()
-        for folder in folders:
+        for folder in self.folders:
             if folder.route in routes:
-                raise Exception(f"Duplicate route: {folder.route} in {path}")
+                raise Exception(f"Duplicate route: {folder.route} in {self.path}")
             routes.add(folder.route)
-        for file in files:
+        for file in self.files:
             if file.route in routes:
-                raise Exception(f"Duplicate route: {file.route} in {path}")
+                raise Exception(f"Duplicate route: {file.route} in {self.path}")
             routes.add(file.route)
-
-        return cls(path, folders, files, assets)
-
-    @property
-    def route(self) -> str:
-        return TITLE_PREFIX_RE.sub("", self.path.name)
-
-    @property
-    def title(self) -> str:
-        name = self.path.stem
-        name = TITLE_PREFIX_RE.sub("", name)
-        return name.replace("_", " ")
-
-    @property
-    def no_content(self):
-        return all(f.empty for f in self.folders) and all(f.draft for f in self.files)
-
-    @property
-    def empty(self) -> bool:
-        return self.no_content and len(self.assets) == 0
@@ -1,10 +1,9 @@
 import asyncio
-import warnings
 from dataclasses import dataclass
 from pathlib import Path
 
 import aiohttp
-from bs4 import BeautifulSoup, XMLParsedAsHTMLWarning
+from lxml import etree
 
 
 @dataclass
@@ -34,7 +33,6 @@ class LibInfo:
         return f"https://repo1.maven.org/maven2/{self.package.replace('.', '/')}/{self.artifact}/{self.version}/{self.artifact}-{self.version}.pom"
 
 loop = asyncio.new_event_loop()
-warnings.filterwarnings("ignore", category=XMLParsedAsHTMLWarning)
 
 class DependencyDownloader:
     def __init__(self, cache_dir: Path, libs: list[str], is_wasm: bool):
@@ -42,9 +40,19 @@ class DependencyDownloader:
         self.collected: set[str] = set()
         self.libs = libs
         self.is_wasm = is_wasm
+        self.session: aiohttp.ClientSession | None = None
 
     def run(self):
-        loop.run_until_complete(self.download_all(self.libs))
+        loop.run_until_complete(self._run())
+
+    async def _run(self):
+        connector = aiohttp.TCPConnector(limit=16, ttl_dns_cache=300, keepalive_timeout=30)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            self.session = session
+            try:
+                await self.download_all(self.libs)
+            finally:
+                self.session = None
 
     async def download_all(self, libs: list[str]):
         to_dl: list[LibInfo] = []
@@ -59,36 +67,35 @@ class DependencyDownloader:
 
         await asyncio.gather(*tasks)
 
-    def collect_deps(self, xml: str) -> list[str]:
-        soup = BeautifulSoup(xml, 'lxml')
+    def collect_deps(self, xml: bytes) -> list[str]:
+        root = etree.fromstring(xml)
+        # Most POMs use the Maven namespace, but it isn't required
+        ns = root.tag[:root.tag.index('}') + 1] if root.tag.startswith('{') else ''
+        suffix = "-wasm-js" if self.is_wasm else "-js"
         found = []
-        for dep in soup.find_all("dependency"):
-            group = dep.find('groupid')
-            artifact = dep.find('artifactid')
-            version = dep.find('version')
-            if not self.is_wasm and not artifact.text.endswith("-js"):
-                continue
-            if self.is_wasm and not artifact.text.endswith("-wasm-js"):
-                continue
-            if group and artifact and version:
-                found.append(f"{group.text}:{artifact.text}:{version.text}")
+        for dep in root.iter(f"{ns}dependency"):
+            group = dep.findtext(f"{ns}groupId")
+            artifact = dep.findtext(f"{ns}artifactId")
+            version = dep.findtext(f"{ns}version")
+            if group and artifact and version and artifact.endswith(suffix):
+                found.append(f"{group}:{artifact}:{version}")
         return found
 
     async def download(self, lib: LibInfo):
         out_file = self.cache_dir / lib.filename
-        async with aiohttp.ClientSession() as session:
-            if not out_file.exists():
-                print(f"Downloading {lib.filename}")
-                async with session.get(lib.url) as resp:
-                    resp.raise_for_status()
-                    data = await resp.read()
-
-                with open(out_file, "wb") as f:
-                    f.write(data)
-
-            async with session.get(lib.pom_url) as resp:
+        if not out_file.exists():
+            print(f"Downloading {lib.filename}")
+            part_file = out_file.with_name(out_file.name + ".part")
+            async with self.session.get(lib.url) as resp:
                 resp.raise_for_status()
-                xml = await resp.text()
+                with open(part_file, "wb") as f:
+                    async for chunk in resp.content.iter_chunked(1 << 16):
+                        await loop.run_in_executor(None, f.write, chunk)
+            part_file.replace(out_file)
+
+        async with self.session.get(lib.pom_url) as resp:
+            resp.raise_for_status()
+            xml = await resp.read()
 
         libs = await loop.run_in_executor(None, self.collect_deps, xml)
         await self.download_all(libs)
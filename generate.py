@@ -1,38 +1,61 @@
+import asyncio
+import hashlib
+import json
 import os
 import re
 import shutil
 import tempfile
 import traceback
-import uuid
-from dataclasses import dataclass
+from collections import Counter
+from dataclasses import dataclass, field
 from pathlib import Path
 from subprocess import Popen, PIPE
 from tempfile import mkdtemp
 from typing import Optional
 
 import jinja2
+import lxml.html
 import markdown
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, Comment
 from pygments.formatters import HtmlFormatter
 
 from config import Config
 from data import FolderEntry, FileEntry
 from dependency_downloader import DependencyDownloader, LibInfo
 
+HEADINGS = ("h1", "h2", "h3", "h4", "h5", "h6")
+SNIPPET_PLACEHOLDER_RE = re.compile(r"<!--kt-snippet-(\d+)-->")
+MARKDOWN_EXTENSIONS = [
+    'attr_list',
+    'codehilite',
+    'fenced_code',
+    'markdown_mermaidjs',
+    'md_in_html',
+    'mdx_math',
+    'meta',
+    'tables',
+]
+
+def add_class(tag: lxml.html.HtmlElement, *classes: str):
+    tag.set("class", " ".join([*tag.get("class", "").split(), *classes]))
 
 @dataclass
 class Context:
     tree: FolderEntry
+    _parents: dict[Path, list[FolderEntry]] = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self._parents = {}
+        stack: list[tuple[FolderEntry, list[FolderEntry]]] = [(self.tree, [])]
+        while stack:
+            folder, chain = stack.pop()
+            for f in folder.files:
+                self._parents[f.path] = chain
+            for f in folder.folders:
+                stack.append((f, chain + [f]))
 
     def _path(self, file: FileEntry) -> list[FolderEntry]:
-        chunks = str(file.path).removeprefix(str(self.tree.path)).removeprefix('/').split('/')[:-1]
-        iterated = []
-        latest = self.tree
-        for c in chunks:
-            f = next(f for f in latest.folders if f.path.name == c)
-            iterated.append(f)
-            latest = f
-        return iterated
+        return self._parents[file.path]
 
     def route(self, item: FileEntry) -> str:
         chunks = [f.route for f in self._path(item)] + [item.route]
@@ -51,29 +74,66 @@ class JsGenerationException(Exception):
 class Generator:
     def __init__(self, config: Config):
         self.config = config
-        self.page_template = jinja2.Template((config.template_dir / 'html_template.jinja').read_text())
-        self.kotlin_import_template = jinja2.Template((config.template_dir / 'kotlin_import_template.jinja').read_text())
-        self.kotlin_template = jinja2.Template((config.template_dir / 'kotlin_template.jinja').read_text())
+        jinja_cache_dir = config.cache_dir / 'jinja'
+        jinja_cache_dir.mkdir(parents=True, exist_ok=True)
+        self.jinja_env = jinja2.Environment(
+            loader=jinja2.FileSystemLoader(str(config.template_dir)),
+            bytecode_cache=jinja2.FileSystemBytecodeCache(str(jinja_cache_dir)),
+        )
+        self.page_template = self.jinja_env.get_template('html_template.jinja')
+        self.kotlin_import_template = self.jinja_env.get_template('kotlin_import_template.jinja')
+        self.kotlin_template = self.jinja_env.get_template('kotlin_template.jinja')
         self.temp_dir = Path(mkdtemp())
         self.valid_snippets: dict[str, str] = {}
+        self.checked_snippets: set[str] = set()
+        self.snippet_soups: dict[Path, BeautifulSoup] = {}
+        self.snippet_counts: Counter[str] = Counter()
+        self.kotlinc_version = ""
+        self.klib_libraries = ""
+        self.npm_digest = ""
+        self._pygments_css: Optional[str] = None
+        self.pending_writes: list[asyncio.Future] = []
+        self.markdown = markdown.Markdown(
+            extensions=MARKDOWN_EXTENSIONS,
+            extension_configs={
+                'codehilite': {
+                    'css_class': 'highlight',
+                    'use_pygments': True,
+                    'pygments_style': config.render_settings.pygments_style,
+                    'linenums': config.render_settings.line_numbers,
+                },
+                'mdx_math': {
+                    'enable_dollar_delimiter': True,
+                }
+            }
+        )
 
     def __del__(self):
         shutil.rmtree(self.temp_dir)
 
     def run(self):
+        asyncio.run(self.run_async())
+
+    async def run_async(self):
         print("[Main] Clearing folders")
         self.config.cache_dir.mkdir(parents=True, exist_ok=True)
 
         print("[Main] Downloading required KLIBs")
-        self.prepare_klibs()
-
         print("[Main] Synchronizing NPM dependencies")
-        self.prepare_npm()
+        await asyncio.gather(
+            asyncio.to_thread(self.prepare_klibs),
+            asyncio.to_thread(self.prepare_npm),
+        )
 
         print("[Main] Parsing file tree")
-        file_tree = FolderEntry.parse(self.config.source_dir)
+        fm_cache = self._load_fm_cache()
+        file_tree = FolderEntry.parse(self.config.source_dir, fm_cache)
+        self._save_fm_cache(fm_cache)
         ctx = Context(file_tree)
 
+        print("[Main] Validating Kotlin snippets")
+        self.validate_snippets(self.collect_snippets(file_tree))
+
         print("[Main] Generating files recursively")
         self.generate_files(ctx, file_tree, self.temp_dir)
 
@@ -81,6 +141,9 @@ class Generator:
             print("[Main] Building Master Bundle")
             self.build_master_bundle()
 
+        await asyncio.gather(*self.pending_writes)
+        self.pending_writes.clear()
+
         print("[Main] Copying extra files")
         for (src, dest) in self.config.extra_files.items():
             dest_path = self.temp_dir / dest
@@ -90,9 +153,23 @@ class Generator:
         shutil.rmtree(self.config.output_dir, ignore_errors=True)
         shutil.copytree(self.temp_dir, self.config.output_dir)
 
+    def _load_fm_cache(self) -> dict:
+        cache_file = self.config.cache_dir / 'frontmatter.json'
+        try:
+            return json.loads(cache_file.read_text())
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            return {}
+
+    def _save_fm_cache(self, cache: dict):
+        (self.config.cache_dir / 'frontmatter.json').write_text(json.dumps(cache))
+
     def build_master_bundle(self):
         print("[Master Bundle] Compiling with kotlinc-js")
-        master_kt = "import kotlin.js.JsExport\n" + "\n".join("@JsExport\n" + self.kotlin_template.render(content=source, id=module) for (module, source) in self.valid_snippets.items())
+        parts = ["import kotlin.js.JsExport"]
+        for (module, source) in self.valid_snippets.items():
+            parts.append("@JsExport")
+            parts.append(self.kotlin_template.render(content=source, id=module))
+        master_kt = "\n".join(parts)
         full_kt = self.kotlin_import_template.render(content=master_kt)
         js_content = self.kotlinc(full_kt, "bundle")
 
@@ -101,11 +178,41 @@ class Generator:
         out_file.parent.mkdir(parents=True, exist_ok=True)
         out_file.write_text(js_content)
 
+    def collect_snippets(self, folder: FolderEntry) -> list[str]:
+        sources = []
+        for f in folder.files:
+            if f.draft or 'text/kotlin' not in f.body: continue
+            soup = BeautifulSoup(f.body, 'html.parser')
+            self.snippet_soups[f.path] = soup
+            sources.extend(script.text for script in soup.find_all('script', {"type": "text/kotlin"}))
+        for f in folder.folders:
+            if f.empty: continue
+            sources.extend(self.collect_snippets(f))
+        return sources
+
+    def validate_snippets(self, sources: list[str]):
+        unique = {self.snippet_digest(source): source for source in dict.fromkeys(sources)}
+        if not unique:
+            return
+
+        print(f"[Kotlin] Validating {len(unique)} snippets in one pass")
+        full_source = "\n".join(self.kotlin_template.render(content=source, id=module) for (module, source) in unique.items())
+        full_source = self.kotlin_import_template.render(content=full_source)
+        try:
+            self.kotlinc(full_source, "snippets", check_only=True)
+        except JsGenerationException:
+            print("[Kotlin] Combined validation failed, falling back to per-snippet validation")
+            return
+        self.checked_snippets.update(unique.values())
+
+    def write_in_background(self, fn, *args):
+        self.pending_writes.append(asyncio.get_running_loop().run_in_executor(None, fn, *args))
+
     def generate_files(self, ctx: Context, folder: FolderEntry, output_dir: Path):
         output_dir.mkdir(exist_ok=True)
 
         for a in folder.assets:
-            shutil.copyfile(a, output_dir / a.name)
+            self.write_in_background(shutil.copyfile, a, output_dir / a.name)
         for f in folder.files:
             if f.draft: continue
             self.generate_file(ctx, f, output_dir / f.route)
@@ -116,25 +223,11 @@ class Generator:
     def generate_file(self, ctx: Context, file: FileEntry, output_file: Path):
         output_file.parent.mkdir(parents=True, exist_ok=True)
 
-        print(f"[Markdown - {ctx.route(file)}] Parsing nested HTML")
-        soup = BeautifulSoup(file.path.read_text(), 'html.parser')
-        content = str(soup)
-
-        for script in soup.find_all('script', {"type": "text/kotlin"}):
-            next_sib = script.next_sibling
-            while next_sib and next_sib.text.isspace():
-                next_sib = next_sib.next_sibling
-            if next_sib and "controls" in next_sib.get("class", []):
-                snippet_html, snippet_id = self.generate_kotlin_snippet(script.text)
-                if snippet_id is None:
-                    new_html = snippet_html
-                else:
-                    controls_snippet = jinja2.Template(str(next_sib)).render(id=snippet_id)
-                    new_html = snippet_html.replace('<div class="kt-controls">', '<div class="kt-controls">' + controls_snippet)
-                    content = content.replace(str(next_sib), '', 1)
-            else:
-                new_html, _ = self.generate_kotlin_snippet(script.text)
-            content = content.replace(str(script), new_html, 1)
+        content = file.body
+        soup = self.snippet_soups.pop(file.path, None)
+        if soup is not None:
+            print(f"[Markdown - {ctx.route(file)}] Parsing nested HTML")
+            content = self.embed_kotlin_snippets(soup)
 
         print(f"[Markdown - {ctx.route(file)}] Converting Markdown")
         try:
@@ -143,17 +236,17 @@ class Generator:
             html_processed, summary = self.postprocess_html(html_post)
         except Exception as e:
             traceback.print_exception(e)
-            output_file.write_text(self.page_template.render(
+            self.write_in_background(output_file.write_text, self.page_template.render(
                 ctx=ctx,
                 file=file,
-                content=file.path.read_text(),
+                content=file.body,
                 page_summary=f"<pre><code>An error occurred rendering this page:\n{traceback.format_exception(e)}</code></pre>",
                 syntax_css=self.pygments_css_style()
             ))
             return
 
         print(f"[Markdown - {ctx.route(file)}] Writing to file")
-        output_file.write_text(self.page_template.render(
+        self.write_in_background(output_file.write_text, self.page_template.render(
             ctx=ctx,
             file=file,
             content=html_processed,
@@ -161,7 +254,33 @@ class Generator:
             syntax_css=self.pygments_css_style()
         ))
 
+    def embed_kotlin_snippets(self, soup: BeautifulSoup) -> str:
+        snippets: list[str] = []
+        for script in soup.find_all('script', {"type": "text/kotlin"}):
+            next_sib = script.next_sibling
+            while next_sib and next_sib.text.isspace():
+                next_sib = next_sib.next_sibling
+            if next_sib and "controls" in next_sib.get("class", []):
+                snippet_html, snippet_id = self.generate_kotlin_snippet(script.text)
+                if snippet_id is None:
+                    new_html = snippet_html
+                else:
+                    controls_snippet = self.jinja_env.from_string(str(next_sib)).render(id=snippet_id)
+                    new_html = snippet_html.replace('<div class="kt-controls">', '<div class="kt-controls">' + controls_snippet)
+                    next_sib.extract()
+            else:
+                new_html, _ = self.generate_kotlin_snippet(script.text)
+            script.replace_with(Comment(f"kt-snippet-{len(snippets)}"))
+            snippets.append(new_html)
+
+        return SNIPPET_PLACEHOLDER_RE.sub(lambda m: snippets[int(m.group(1))], str(soup))
+
     def pygments_css_style(self) -> str:
+        if self._pygments_css is None:
+            self._pygments_css = self._build_pygments_css_style()
+        return self._pygments_css
+
+    def _build_pygments_css_style(self) -> str:
         style_light = HtmlFormatter(style=self.config.render_settings.pygments_style).get_style_defs('.highlight')
         style_dark = HtmlFormatter(style=self.config.render_settings.pygments_style_dark).get_style_defs('.dark-mode .highlight')
         style_dark = style_dark\
@@ -170,11 +289,14 @@ class Generator:
         return style_light + "\n" + style_dark
 
     def generate_kotlin_snippet(self, source: str) -> tuple[str, Optional[str]]:
-        snippet_id = uuid.uuid4().hex
+        digest = self.snippet_digest(source)
+        snippet_id = f"{digest}_{self.snippet_counts[digest]}"
+        self.snippet_counts[digest] += 1
 
         try:
-            print(f"[Kotlin - {snippet_id}] Validating snippet")
-            self.validate_snippet(source, snippet_id)
+            if source not in self.checked_snippets:
+                print(f"[Kotlin - {snippet_id}] Validating snippet")
+                self.validate_snippet(source, snippet_id)
             self.valid_snippets[snippet_id] = source
             return f"""
 <div id="container-{snippet_id}" class="kt-container card text-left">
@@ -211,34 +333,37 @@ class Generator:
         self.kotlinc(full_source, snippet_id, check_only = True)
 
     def render_markdown(self, source: str) -> str:
-        extensions = [
-            'attr_list',
-            'codehilite',
-            'fenced_code',
-            'markdown_mermaidjs',
-            'md_in_html',
-            'mdx_math',
-            'meta',
-            'tables',
-        ]
-        extension_configs = {
-            'codehilite': {
-                'css_class': 'highlight',
-                'use_pygments': True,
-                'pygments_style': self.config.render_settings.pygments_style,
-                'linenums': self.config.render_settings.line_numbers,
-            },
-            'mdx_math': {
-                'enable_dollar_delimiter': True,
-            }
-        }
-        return markdown.markdown(
-            source,
-            extensions=extensions,
-            extension_configs=extension_configs
-        )
+        return self.markdown.reset().convert(source)
+
+    @staticmethod
+    def snippet_digest(source: str) -> str:
+        return hashlib.blake2b(source.encode(), digest_size=16).hexdigest()
+
+    def kotlinc_cache_key(self, source: str, module: str, check_only: bool) -> str:
+        parts = [source, module, str(check_only), self.kotlinc_version,
+                 *self.config.kotlin_settings.kotlinc_args, *self.config.kotlin_settings.klibs]
+        if not check_only:
+            parts.append(self.npm_digest)
+        h = hashlib.blake2b(digest_size=32)
+        for part in parts:
+            h.update(part.encode())
+            h.update(b"\0")
+        return h.hexdigest()
 
     def kotlinc(self, source: str, module: str, check_only: bool = False) -> str:
+        cache_file = self.config.cache_dir / 'snippets' / f'{self.kotlinc_cache_key(source, module, check_only)}.js'
+        if cache_file.exists():
+            print(f"[Kotlin - {module}] Using cached output")
+            return cache_file.read_text()
+
+        js_content = self._kotlinc(source, module, check_only)
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = cache_file.with_name(f'{cache_file.name}.{os.getpid()}.tmp')
+        tmp_file.write_text(js_content)
+        tmp_file.replace(cache_file)
+        return js_content
+
+    def _kotlinc(self, source: str, module: str, check_only: bool) -> str:
         with tempfile.TemporaryDirectory() as d:
             work_path = Path(d)
             kt_file = work_path / "source.kt"
@@ -248,7 +373,7 @@ class Generator:
             process = Popen(
                 [
                     'kotlinc-js',
-                    '-libraries', ':'.join(str(klib.absolute()) for klib in self.config.cache_dir.glob('*.klib')),
+                    '-libraries', self.klib_libraries,
                     '-ir-output-dir', str(work_path / 'out' / 'klib'),
                     '-ir-output-name', module,
                     '-Xir-produce-klib-file',
@@ -269,7 +394,7 @@ class Generator:
             process = Popen(
                 [
                     'kotlinc-js',
-                    '-libraries', ':'.join(str(klib.absolute()) for klib in self.config.cache_dir.glob('*.klib')),
+                    '-libraries', self.klib_libraries,
                     '-ir-output-dir', str(work_path / 'out' / 'js'),
                     '-ir-output-name', module,
                     '-Xir-produce-js',
@@ -313,30 +438,43 @@ class Generator:
             return bundled_js_path.read_text()
 
     def postprocess_html(self, html: str) -> tuple[str, str]:
-        soup = BeautifulSoup(html, "html.parser")
-        for tag in soup.find_all("img"):
-            tag["class"] = list(tag.get("class", [])) + ["img-fluid"]
-        for tag in soup.find_all("a"):
-            tag["class"] = list(tag.get("class", [])) + ["hyperlink"]
-        for tag in soup.find_all("table"):
-            if "highlighttable" in tag.get("class", []):
-                code = tag.find("td", {"class": "code"})
-                code["class"] = []
-            else:
-                tag["class"] = list(tag.get("class", [])) + ["table", "table-striped", "table-hover"]
+        root = lxml.html.fragment_fromstring(html, create_parent="div")
+        headings: dict[str, list[lxml.html.HtmlElement]] = {h: [] for h in HEADINGS}
+        for tag in root.iter():
+            if tag.tag == "img":
+                add_class(tag, "img-fluid")
+            elif tag.tag == "a":
+                add_class(tag, "hyperlink")
+            elif tag.tag == "table":
+                if "highlighttable" in tag.get("class", "").split():
+                    for code in tag.iter("td"):
+                        if "code" in code.get("class", "").split():
+                            code.set("class", "")
+                            break
+                else:
+                    add_class(tag, "table", "table-striped", "table-hover")
+            elif tag.tag in headings:
+                headings[tag.tag].append(tag)
+
+        # Anchors are appended after the walk so they don't pick up the hyperlink class
         headers = []
-        for h in ("h1", "h2", "h3", "h4", "h5", "h6"):
-            for tag in soup.find_all(h):
-                tag["class"] = list(tag.get("class", [])) + ["content-title"]
-                tag_id = tag.text.replace(' ', '-')
-                headers.append(f'<a href="#{tag_id}">{tag.text}</a>')
-                tag["id"] = tag_id
-                tag.append(BeautifulSoup(f' <a href="#{tag_id}" class="ml-5 text-decoration-none">#</a>', "html.parser"))
-
-        if headers:
-            return str(soup), "\n".join(headers)
-        else:
-            return str(soup), ""
+        for h in HEADINGS:
+            for tag in headings[h]:
+                add_class(tag, "content-title")
+                text = tag.text_content()
+                tag_id = text.replace(' ', '-')
+                headers.append(f'<a href="#{tag_id}">{text}</a>')
+                tag.set("id", tag_id)
+                if len(tag):
+                    tag[-1].tail = (tag[-1].tail or "") + " "
+                else:
+                    tag.text = (tag.text or "") + " "
+                anchor = lxml.html.Element("a", href=f"#{tag_id}", **{"class": "ml-5 text-decoration-none"})
+                anchor.text = "#"
+                tag.append(anchor)
+
+        content = (root.text or "") + "".join(lxml.html.tostring(el, encoding="unicode") for el in root)
+        return content, "\n".join(headers)
 
     def prepare_klibs(self):
         kc_version_proc = Popen(["kotlinc-js", "-version"], stderr=PIPE)
@@ -344,6 +482,7 @@ class Generator:
         output = stderr.decode()
         match = re.search(r"kotlinc-js ([\d.]+)", output)
         kver = match.group(1)
+        self.kotlinc_version = kver
         is_wasm = "-Xwasm" in self.config.kotlin_settings.kotlinc_args
         downloader = DependencyDownloader(
             self.config.cache_dir,
@@ -351,9 +490,18 @@ class Generator:
             is_wasm,
         )
         downloader.run()
+        self.klib_libraries = ':'.join(str(klib.absolute()) for klib in self.config.cache_dir.glob('*.klib'))
 
     def prepare_npm(self):
         shutil.copyfile(self.config.template_dir / "package.json", self.config.cache_dir / "package.json")
+        h = hashlib.blake2b(digest_size=32)
+        for name in ("package.json", "package-lock.json"):
+            manifest = self.config.template_dir / name
+            if manifest.is_file():
+                h.update(name.encode())
+                h.update(b"\0")
+                h.update(manifest.read_bytes())
+        self.npm_digest = h.hexdigest()
 
         print(f"[NPM] Installing packages in {self.config.cache_dir}")
         process = Popen(
@@ -1,61 +1,155 @@
 import argparse
-import json
+import asyncio
 import os
-import shutil
+import pickle
 import sys
+from dataclasses import fields
 
-from config import Config
-from generate import Generator
+import orjson
 
+from config import Config, KotlinConfig, RenderConfig
+
+CONFIG_CACHE_FILE = os.path.join(os.path.expanduser("~"), ".cache", "devblog", "config.pkl")
+CONFIG_SCHEMA = ",".join(f"{cls.__name__}.{f.name}" for cls in (Config, RenderConfig, KotlinConfig) for f in fields(cls))
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("-c", "--config", type=str, default="./config.json")
     parser.add_argument("--serve", action='store_true', default=False)
     parser.add_argument("--no-cache", action='store_true', default=False)
+    parser.add_argument("--skip-config-rewrite", action='store_true', default=False)
     args = parser.parse_args(sys.argv[1:])
 
-    config: Config | None
-    if not os.path.exists(args.config):
+    config: Config | None = None
+    try:
+        with open(args.config, "rb") as f:
+            st = os.fstat(f.fileno())
+            config = load_cached_config(args.config, st)
+            if config is None:
+                config = Config.from_dict(orjson.loads(f.read()))
+                save_cached_config(args.config, st, config)
+    except (FileNotFoundError, orjson.JSONDecodeError, KeyError):
         config = None
-    else:
-        try:
-            with open(args.config, "r") as f:
-                conf = json.load(f)
-            config = Config.from_dict(conf)
-        except (json.decoder.JSONDecodeError, FileNotFoundError, KeyError):
-            config = None
 
     if config is None:
         config = Config.default()
-        with open(args.config, "w") as f:
-            json.dump(config.to_dict(), f, indent=2)
+        if not args.skip_config_rewrite:
+            tmp = args.config + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(orjson.dumps(config.to_dict(), option=orjson.OPT_INDENT_2))
+            os.replace(tmp, args.config)
 
-    if args.no_cache:
-        shutil.rmtree(config.cache_dir, ignore_errors=True)
+    if args.no_cache and os.path.isdir(config.cache_dir):
+        clear_cache(config.cache_dir)
 
+    from generate import Generator
     generator = Generator(config)
-    generator.run()
+    asyncio.run(generator.run_async())
 
     if args.serve:
         serve(config)
 
+def _config_cache_key(path: str, st: os.stat_result) -> str:
+    return f"{os.path.abspath(path)}:{st.st_mtime_ns}:{st.st_size}:{CONFIG_SCHEMA}"
+
+def load_cached_config(path: str, st: os.stat_result) -> Config | None:
+    try:
+        with open(CONFIG_CACHE_FILE, "rb") as f:
+            key, config = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError, TypeError):
+        return None
+    if key != _config_cache_key(path, st):
+        return None
+    return config
+
+def save_cached_config(path: str, st: os.stat_result, config: Config):
+    try:
+        os.makedirs(os.path.dirname(CONFIG_CACHE_FILE), exist_ok=True)
+        with open(CONFIG_CACHE_FILE, "wb") as f:
+            pickle.dump((_config_cache_key(path, st), config), f)
+    except OSError:
+        pass
+
+def clear_cache(path: str | os.PathLike):
+    import shutil
+    import subprocess
+    from concurrent.futures import ThreadPoolExecutor
+
+    use_rm = os.name == 'posix' and shutil.which('rm') is not None
+
+    def remove(entry: os.DirEntry):
+        try:
+            if not entry.is_dir(follow_symlinks=False):
+                os.unlink(entry.path)
+            elif use_rm:
+                subprocess.run(['rm', '-rf', '--', entry.path], check=False)
+            else:
+                _fast_rmtree(entry.path)
+        except OSError:
+            pass
+
+    if os.path.islink(path):
+        return
+
+    try:
+        with os.scandir(path) as it:
+            entries = list(it)
+    except OSError:
+        return
+    with ThreadPoolExecutor(max_workers=min(8, len(entries) or 1)) as executor:
+        list(executor.map(remove, entries))
+    try:
+        os.rmdir(path)
+    except OSError:
+        pass
+
+def _fast_rmtree(path: str | os.PathLike):
+    dirs = []
+    stack = [os.fspath(path)]
+    while stack:
+        current = stack.pop()
+        dirs.append(current)
+        try:
+            with os.scandir(current) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        else:
+                            os.unlink(entry.path)
+                    except OSError:
+                        pass
+        except OSError:
+            pass
+    for d in reversed(dirs):
+        try:
+            os.rmdir(d)
+        except OSError:
+            pass
+
 def serve(config: Config):
     print(f"[Server] Starting server. Please note that this is not recommended for production use.")
-    import http.server
-    import socketserver
+    from aiohttp import web
+
+    output_dir = config.output_dir.resolve()
 
-    class Handler(http.server.SimpleHTTPRequestHandler):
-        def __init__(self, *args, **kwargs):
-            super().__init__(*args, directory=str(config.output_dir), **kwargs)
+    @web.middleware
+    async def directory_index(request: web.Request, handler):
+        target = (output_dir / request.path.lstrip('/')).resolve()
+        if target.is_relative_to(output_dir) and target.is_dir():
+            if not request.path.endswith('/'):
+                raise web.HTTPMovedPermanently(request.rel_url.with_path(request.path + '/').with_query(request.rel_url.query))
+            index = target / 'index.html'
+            if index.is_file():
+                return web.FileResponse(index)
+        return await handler(request)
+
+    app = web.Application(middlewares=[directory_index])
+    app.router.add_static('/', str(output_dir), show_index=True)
 
     print(f"[Server] Serving at http://localhost:8000")
-    with socketserver.TCPServer(("localhost", 8000), Handler) as httpd:
-        try:
-            httpd.serve_forever()
-        except KeyboardInterrupt:
-            print("[Server] Stopping...")
-            httpd.shutdown()
+    web.run_app(app, host="localhost", port=8000, reuse_address=True, print=None)
+    print("[Server] Stopping...")
 
 if __name__ == '__main__':
     main()